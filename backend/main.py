@@ -1,13 +1,87 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+import anyio
+import asyncio
+import contextlib
+import glob
+import hashlib
+import io
+import mmap
 import uuid
 import os
-import whisper
-import tempfile
-import traceback
+import shutil
+import ctranslate2
+import av
+import numpy as np
+import orjson
+import soundfile as sf
+from faster_whisper import decode_audio
+from faster_whisper.vad import get_speech_timestamps
+import logging
+import multiprocessing
+import queue
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO
+from logging.handlers import QueueHandler, QueueListener
+import whisper_worker
+from whisper_worker import BATCH_SIZE, SAMPLE_RATE, WINDOW_SECONDS
 
-app = FastAPI()
+# Log records are handed to a background thread for I/O so a slow stdout
+# (e.g. a docker/journald pipe) never stalls a request
+log = logging.getLogger(__name__)
+_log_queue = queue.Queue(-1)
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+for _logger in (log, whisper_worker.log):
+    _logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    _logger.propagate = False
+    _logger.addHandler(QueueHandler(_log_queue))
+_log_listener = QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+
+# orjson encodes the (often long) transcript responses much faster than stdlib json
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Largest request body accepted; raise it for very long recordings
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_BYTES", str(100 * 1024 * 1024)))
+
+class MaxBodySizeMiddleware:
+    """Reject request bodies larger than max_bytes with 413 before they are buffered"""
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request body exceeds the {self.max_bytes} byte limit"
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = ORJSONResponse(status_code=413, content={"detail": detail})
+            await response(scope, receive, send)
+            return
+
+        # Chunked uploads carry no Content-Length, so also count bytes as they arrive
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# Added before CORS so that CORS headers are also set on 413 responses
+app.add_middleware(MaxBodySizeMiddleware, max_bytes=MAX_AUDIO_BYTES)
 
 # CORS middleware - MUST be added before routes
 app.add_middleware(
@@ -20,167 +94,271 @@ app.add_middleware(
 
 # Ensure uploads directory exists
 os.makedirs("uploads", exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+# Micro-batching: short clips from concurrent requests are queued and
+# transcribed together in a single batched forward pass
+BATCH_MAX_WAIT = int(os.getenv("WHISPER_BATCH_MAX_WAIT_MS", "50")) / 1000
+# Several short clips share one 30 second window, so a batch can take more clips
+# than BATCH_SIZE windows
+BATCH_MAX_CLIPS = int(os.getenv("WHISPER_BATCH_MAX_CLIPS", str(4 * BATCH_SIZE)))
+batch_queue: asyncio.Queue = asyncio.Queue()
+
+# LRU cache of finished transcriptions keyed by the SHA-256 of the uploaded bytes
+TRANSCRIPTION_CACHE_SIZE = int(os.getenv("TRANSCRIPTION_CACHE_SIZE", "1024"))
+TRANSCRIPTION_CACHE: "OrderedDict[str, str]" = OrderedDict()
+
+# Optional process pool for inference. With WHISPER_WORKERS > 0 each worker process
+# loads its own model, pinned round-robin to a GPU, so Whisper's Python-side pre- and
+# post-processing no longer competes with request handling for the GIL.
+# The default of 0 runs inference in threads of this process.
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", "0"))
+
+# Upper bound on inference calls running at once (batches and long recordings);
+# size it to how many model instances fit in GPU memory. With a pool this defaults
+# to one call per worker process, since a lower value would leave workers idle.
+INFER_SEM = asyncio.Semaphore(int(os.getenv("WHISPER_CONCURRENCY", str(WHISPER_WORKERS or 2))))
+EXECUTOR = None
+_mp_context = multiprocessing.get_context("spawn")
+_segment_manager = None
+
+class AudioDecodeError(ValueError):
+    """Raised when an upload can't be decoded as audio"""
 
-# Load Whisper model (base model - good balance of speed and accuracy)
-# Model is loaded once at startup for better performance
-_whisper_model = None
+def log_failure(context: str, exc: BaseException):
+    """Log an error; the traceback is only formatted when DEBUG logging is enabled"""
+    log.error("Error in %s: %s", context, exc, exc_info=exc if log.isEnabledFor(logging.DEBUG) else None)
 
-def check_ffmpeg():
-    """Check if FFmpeg is installed (required by Whisper)"""
-    import subprocess
-    import shutil
+def load_audio(audio_file: BinaryIO) -> np.ndarray:
+    """Decode an in-memory or memory-mapped audio file to 16 kHz mono float32 samples"""
     try:
-        # First check if ffmpeg is in PATH
-        ffmpeg_path = shutil.which('ffmpeg')
-        if ffmpeg_path:
-            print(f"✓ FFmpeg found at: {ffmpeg_path}")
-            # Verify it works
-            result = subprocess.run(['ffmpeg', '-version'], 
-                          capture_output=True, 
-                          check=True, 
-                          timeout=5)
-            print("✓ FFmpeg is working correctly")
-            return True
-        else:
-            raise FileNotFoundError("FFmpeg not in PATH")
-    except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired, OSError) as e:
-        print("⚠ WARNING: FFmpeg not found. Whisper requires FFmpeg to process audio files.")
-        print("  Please install FFmpeg:")
-        print("  - Windows: Download from https://www.gyan.dev/ffmpeg/builds/")
-        print("            Or use: winget install ffmpeg")
-        print("            Or use: choco install ffmpeg")
-        print("  - Make sure to add FFmpeg to your system PATH")
-        print("  - Restart your terminal/server after installation")
-        print("  - Verify with: ffmpeg -version")
-        return False
-
-def get_whisper_model():
-    """Lazy load Whisper model to avoid loading on import"""
-    global _whisper_model
-    if _whisper_model is None:
-        print("Loading Whisper model...")
+        with sf.SoundFile(audio_file) as f:
+            # 16 kHz WAV/FLAC reads directly without a resampling pass
+            if f.samplerate == SAMPLE_RATE:
+                return f.read(dtype="float32", always_2d=True).mean(axis=1)
+    except RuntimeError:
+        # Formats libsndfile can't read (webm/opus, m4a) are decoded below
+        pass
+    # PyAV decodes any container FFmpeg supports and resamples to 16 kHz mono
+    audio_file.seek(0)
+    try:
+        return decode_audio(audio_file, sampling_rate=SAMPLE_RATE)
+    except av.error.FFmpegError as e:
+        raise AudioDecodeError(str(e)) from e
+    except IndexError as e:
+        # decode_audio indexes the first audio stream, e.g. a video-only mp4 has none
+        raise AudioDecodeError("no audio stream found") from e
+
+def strip_silence(audio: np.ndarray) -> np.ndarray:
+    """Keep only the speech regions found by faster-whisper's bundled Silero VAD model"""
+    timestamps = get_speech_timestamps(audio, sampling_rate=SAMPLE_RATE)
+    if not timestamps:
+        return audio[:0]
+    return np.concatenate([audio[t["start"]:t["end"]] for t in timestamps])
+
+async def cache_key(data) -> str:
+    """SHA-256 of the uploaded bytes, hashed in a worker thread so large files don't block the event loop"""
+    return await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+
+def get_cached_transcription(key: str):
+    """Return a cached transcription and mark it as recently used"""
+    transcription = TRANSCRIPTION_CACHE.get(key)
+    if transcription is not None:
+        TRANSCRIPTION_CACHE.move_to_end(key)
+    return transcription
+
+def cache_transcription(key: str, transcription: str):
+    """Store a transcription, evicting the least recently used entry when full"""
+    TRANSCRIPTION_CACHE[key] = transcription
+    TRANSCRIPTION_CACHE.move_to_end(key)
+    while len(TRANSCRIPTION_CACHE) > TRANSCRIPTION_CACHE_SIZE:
+        TRANSCRIPTION_CACHE.popitem(last=False)
+
+async def run_inference(func, *args):
+    """Run a whisper_worker function in the process pool when one is configured, else in a thread"""
+    # Either way the event loop keeps serving other requests during inference
+    if EXECUTOR is not None:
+        return await asyncio.get_running_loop().run_in_executor(EXECUTOR, func, *args)
+    return await asyncio.to_thread(func, *args)
+
+async def stream_transcription(audio: np.ndarray):
+    """Yield (start, end, text) for each segment as soon as it is decoded"""
+    if EXECUTOR is None:
+        # Shielded so a disconnect doesn't abandon the step running in its thread
+        step = asyncio.ensure_future(asyncio.to_thread(whisper_worker.transcribe_segments, audio))
         try:
-            _whisper_model = whisper.load_model("base")
-            print("Whisper model loaded successfully")
+            segments = iter(await asyncio.shield(step))
+            while True:
+                step = asyncio.ensure_future(asyncio.to_thread(next, segments, None))
+                if (segment := await asyncio.shield(step)) is None:
+                    break
+                yield segment.start, segment.end, segment.text
+        finally:
+            # The caller's INFER_SEM slot stays held until the thread is free again.
+            # Starlette cancels a disconnected stream through an anyio cancel scope,
+            # which would also cancel this wait unless it is shielded.
+            with anyio.CancelScope(shield=True):
+                await asyncio.wait((step,))
+        return
+    
+    # A pool worker can't hand back a generator, so segments come through a managed queue
+    segment_queue = _segment_manager.Queue()
+    stop_event = _segment_manager.Event()
+    job = asyncio.get_running_loop().run_in_executor(
+        EXECUTOR, whisper_worker.stream_segments, audio, segment_queue, stop_event
+    )
+    try:
+        while True:
+            read = asyncio.ensure_future(asyncio.to_thread(segment_queue.get))
+            # A worker that dies (segfault, OOM kill) never puts the closing None, so
+            # watch the job too and raise its error if it ends first
+            await asyncio.wait((read, job), return_when=asyncio.FIRST_COMPLETED)
+            if not read.done():
+                job.result()
+            if (item := await read) is None:
+                break
+            yield item
+        await job
+    finally:
+        # If the client went away, stop the worker after its current segment. The extra
+        # None releases a reader thread still blocked on the queue, e.g. after the worker
+        # died. Waiting for the job, shielded as above, keeps the caller's INFER_SEM slot
+        # held until the worker is actually free.
+        stop_event.set()
+        segment_queue.put(None)
+        with anyio.CancelScope(shield=True):
+            await asyncio.wait((job,))
+
+async def batch_worker():
+    """Collect queued clips for up to BATCH_MAX_WAIT seconds and transcribe them together"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await batch_queue.get()]
+        deadline = loop.time() + BATCH_MAX_WAIT
+        while len(batch) < BATCH_MAX_CLIPS:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(batch_queue.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+
+        log.debug("Transcribing batch of %d clip(s)", len(batch))
+        try:
+            async with INFER_SEM:
+                texts = await run_inference(whisper_worker.transcribe_batch, [audio for audio, _ in batch])
         except Exception as e:
-            print(f"Error loading Whisper model: {e}")
-            raise
-    return _whisper_model
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), text in zip(batch, texts):
+                if not future.done():
+                    future.set_result(text)
+
+@app.on_event("startup")
+async def preload_whisper_model():
+    """Start the worker pool if configured, then load the models and run a warmup pass"""
+    global EXECUTOR, _segment_manager
+    if WHISPER_WORKERS > 0:
+        n_gpus = 0 if os.getenv("WHISPER_DEVICE") == "cpu" else ctranslate2.get_cuda_device_count()
+        EXECUTOR = ProcessPoolExecutor(
+            max_workers=WHISPER_WORKERS,
+            mp_context=_mp_context,
+            initializer=whisper_worker.init_worker,
+            initargs=(_mp_context.Value("i", 0), n_gpus),
+        )
+        _segment_manager = _mp_context.Manager()
+        log.info("Started %d Whisper worker process(es) across %d GPU(s)", WHISPER_WORKERS, n_gpus)
+    
+    await asyncio.gather(*(run_inference(whisper_worker.warmup) for _ in range(max(WHISPER_WORKERS, 1))))
+    # strip_silence runs in this process, so load its Silero VAD model here too
+    await asyncio.to_thread(strip_silence, np.zeros(SAMPLE_RATE, dtype=np.float32))
+    log.info("Whisper model warmed up")
 
-# Check FFmpeg on startup
-check_ffmpeg()
+@app.on_event("startup")
+async def start_batch_worker():
+    """Start the background task that drains the batch queue"""
+    app.state.batch_worker = asyncio.create_task(batch_worker())
 
-async def transcribe_with_whisper(audio_bytes: bytes, filename: str = None, content_type: str = None) -> str:
+@app.on_event("shutdown")
+async def stop_worker_pool():
+    """Stop the worker processes, if any"""
+    if EXECUTOR is not None:
+        EXECUTOR.shutdown(cancel_futures=True)
+        _segment_manager.shutdown()
+
+@app.on_event("shutdown")
+async def stop_log_listener():
+    """Flush queued log records before the process exits"""
+    _log_listener.stop()
+
+async def transcribe_with_whisper(audio_file: BinaryIO) -> str:
     """
-    Transcribe audio using OpenAI Whisper library.
+    Transcribe audio using the faster-whisper library.
+    Clips up to 30 seconds long are queued for batched inference with other requests.
     """
-    temp_file_path = None
-    try:
-        # Determine file extension based on content type or filename
-        suffix = '.wav'  # default
-        if content_type:
-            if 'webm' in content_type.lower():
-                suffix = '.webm'
-            elif 'mp3' in content_type.lower():
-                suffix = '.mp3'
-            elif 'm4a' in content_type.lower():
-                suffix = '.m4a'
-            elif 'ogg' in content_type.lower():
-                suffix = '.ogg'
-        elif filename:
-            # Extract extension from filename
-            _, ext = os.path.splitext(filename.lower())
-            if ext:
-                suffix = ext
-        
-        # Create a temporary file to save the audio bytes
-        # Whisper requires a file path, not raw bytes
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
-            temp_file.write(audio_bytes)
-            temp_file_path = temp_file.name
-        
-        print(f"Saved audio to temporary file: {temp_file_path} (size: {len(audio_bytes)} bytes)")
-        
-        # Verify FFmpeg is available before attempting transcription
-        import shutil
-        if not shutil.which('ffmpeg'):
-            raise FileNotFoundError(
-                "FFmpeg is not installed or not in PATH. "
-                "Please install FFmpeg and restart the server."
-            )
-        
-        # Load the Whisper model
-        print("Loading Whisper model...")
-        model = get_whisper_model()
-        
-        # Transcribe the audio file
-        print(f"Transcribing audio file: {temp_file_path}")
-        result = model.transcribe(temp_file_path)
-        
-        # Extract the text from the result
-        transcription_text = result["text"].strip()
-        
-        print(f"Transcription completed. Length: {len(transcription_text)} characters")
-        
-        return transcription_text
-        
-    except (FileNotFoundError, OSError) as e:
-        # Check if this is an FFmpeg-related error
-        error_str = str(e).lower()
-        if 'winerror 2' in error_str or 'cannot find the file' in error_str or 'ffmpeg' in error_str:
-            error_msg = (
-                "FFmpeg not found. Whisper requires FFmpeg to process audio files.\n\n"
-                "Please install FFmpeg:\n"
-                "- Windows: Download from https://www.gyan.dev/ffmpeg/builds/ or use: winget install ffmpeg\n"
-                "- Make sure FFmpeg is added to your system PATH\n"
-                "- Restart your terminal/server after installation\n"
-                "- Verify with: ffmpeg -version"
-            )
-        else:
-            error_msg = f"File system error: {str(e)}"
-        print(f"Error in transcribe_with_whisper: {error_msg}")
-        print(f"Original error: {str(e)}")
-        print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=error_msg)
-    except ImportError as e:
-        error_msg = f"Whisper library not installed. Please run: pip install openai-whisper"
-        print(f"Error in transcribe_with_whisper: {error_msg}")
-        print(f"Original error: {str(e)}")
-        print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=error_msg)
-    except Exception as e:
-        error_msg = f"Transcription failed: {str(e)}"
-        print(f"Error in transcribe_with_whisper: {error_msg}")
-        print(f"Full traceback:\n{traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=error_msg)
-    finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-                print(f"Cleaned up temporary file: {temp_file_path}")
-            except Exception as cleanup_error:
-                print(f"Warning: Could not delete temporary file {temp_file_path}: {cleanup_error}")
+    # Decode in memory to 16 kHz mono samples so clips can be batched together
+    audio = await asyncio.to_thread(load_audio, audio_file)
+    return await transcribe_samples(audio)
+
+async def transcribe_samples(audio: np.ndarray) -> str:
+    """Transcribe decoded samples, through the batch queue when the clip is short enough"""
+    # Transcribe the audio
+    log.debug("Transcribing audio: %.1f s", len(audio) / SAMPLE_RATE)
+    if 0 < len(audio) <= WINDOW_SECONDS * SAMPLE_RATE:
+        # Batched clips bypass the pipeline's own VAD, so drop silence here
+        audio = await asyncio.to_thread(strip_silence, audio)
+    
+    if len(audio) == 0:
+        transcription_text = ""
+    elif len(audio) <= WINDOW_SECONDS * SAMPLE_RATE:
+        future = asyncio.get_running_loop().create_future()
+        await batch_queue.put((audio, future))
+        transcription_text = await future
+    else:
+        async with INFER_SEM:
+            transcription_text = await run_inference(whisper_worker.transcribe_long, audio)
+    
+    log.debug("Transcription completed. Length: %d characters", len(transcription_text))
+    
+    return transcription_text
 
 async def enhance_with_ai(transcription: str) -> str:
     """
     Enhance transcription using AI to fill in gaps.
     This is a placeholder - you'll need to implement actual AI enhancement.
     """
-    try:
-        # TODO: Implement actual AI enhancement
-        # This could use OpenAI GPT, Claude, or another AI service
-        # to improve the transcription quality
-        
-        # For now, return the transcription as-is
-        return transcription
-    except Exception as e:
-        print(f"Error in enhance_with_ai: {e}")
-        raise HTTPException(status_code=500, detail=f"Enhancement failed: {str(e)}")
+    # TODO: Implement actual AI enhancement
+    # This could use OpenAI GPT, Claude, or another AI service
+    # to improve the transcription quality
+    
+    # For now, return the transcription as-is
+    return transcription
+
+@app.exception_handler(AudioDecodeError)
+async def audio_decode_error_handler(request, exc):
+    """Uploads that aren't decodable audio are a client error"""
+    log_failure(request.url.path, exc)
+    return ORJSONResponse(status_code=400, content={"detail": f"Could not decode audio: {exc}"})
+
+@app.exception_handler(OSError)
+async def os_error_handler(request, exc):
+    """Disk and file errors, e.g. while storing an upload"""
+    log_failure(request.url.path, exc)
+    return ORJSONResponse(status_code=500, content={"detail": f"File system error: {exc}"})
+
+@app.exception_handler(RuntimeError)
+async def inference_error_handler(request, exc):
+    """CTranslate2 failures during inference, e.g. CUDA out of memory"""
+    log_failure(request.url.path, exc)
+    return ORJSONResponse(status_code=500, content={"detail": f"Transcription failed: {exc}"})
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     """Global exception handler to ensure CORS headers are always sent"""
+    log_failure(request.url.path, exc)
     return JSONResponse(
         status_code=500,
         content={"detail": str(exc)},
@@ -193,51 +371,111 @@ async def global_exception_handler(request, exc):
 
 @app.post("/upload/")
 async def upload_audio(file: UploadFile = File(...)):
-    try:
-        # Save uploaded file
-        file_id = str(uuid.uuid4())
-        file_path = f"uploads/{file_id}_{file.filename}"
-        
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
-        return {"file_id": file_id, "filename": file.filename}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    # Save uploaded file
+    file_id = str(uuid.uuid4())
+    file_path = f"uploads/{file_id}_{file.filename}"
+    
+    # Copy Starlette's spooled file straight to disk in a worker thread, in chunks
+    # so large uploads are never held in memory whole
+    with open(file_path, "wb") as f:
+        await asyncio.to_thread(shutil.copyfileobj, file.file, f, UPLOAD_CHUNK_SIZE)
+    
+    return {"file_id": file_id, "filename": file.filename}
 
 @app.post("/transcribe/")
 async def transcribe_audio(audio: UploadFile = File(...)):
-    try:
-        print(f"Received audio file: {audio.filename}, content-type: {audio.content_type}")
-        contents = await audio.read()
-        print(f"Audio file size: {len(contents)} bytes")
-        
-        if len(contents) == 0:
-            raise HTTPException(status_code=400, detail="Empty audio file")
-        
-        transcription = await transcribe_with_whisper(contents, filename=audio.filename, content_type=audio.content_type)
-        return {"original_transcript": transcription}
-    except HTTPException:
-        raise
-    except Exception as e:
-        error_msg = f"Transcription error: {str(e)}"
-        print(f"Error in transcribe_audio: {error_msg}")
-        print(f"Full traceback:\n{traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=error_msg)
+    log.debug("Received audio file: %s, content-type: %s", audio.filename, audio.content_type)
+    contents = await audio.read()
+    log.debug("Audio file size: %d bytes", len(contents))
+    
+    if len(contents) == 0:
+        raise HTTPException(status_code=400, detail="Empty audio file")
+    
+    # Re-uploads of the same audio are served from the cache
+    key = await cache_key(contents)
+    transcription = get_cached_transcription(key)
+    if transcription is None:
+        transcription = await transcribe_with_whisper(io.BytesIO(contents))
+        cache_transcription(key, transcription)
+    
+    return {"original_transcript": transcription}
 
-@app.post("/enhance/")
-async def enhance_transcription(transcription: str):
+@app.post("/transcribe_by_id/")
+async def transcribe_uploaded_audio(file_id: str):
+    """Transcribe a file previously stored by /upload/ without sending its bytes again"""
     try:
-        if not transcription:
-            raise HTTPException(status_code=400, detail="Transcription text is required")
-        
-        enhanced = await enhance_with_ai(transcription)
-        return {"enhanced_transcription": enhanced}
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Error in enhance_transcription: {e}")
-        raise HTTPException(status_code=500, detail=f"Enhancement error: {str(e)}")
+        # Accepts un-hyphenated, braced and urn: forms; /upload/ named the file with the canonical one
+        file_id = str(uuid.UUID(file_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid file_id")
+    
+    matches = glob.glob(f"uploads/{file_id}_*")
+    if not matches:
+        raise HTTPException(status_code=404, detail="Uploaded file not found")
+    file_path = matches[0]
+    
+    if os.path.getsize(file_path) == 0:
+        raise HTTPException(status_code=400, detail="Empty audio file")
+    
+    # Map the stored file instead of reading it into a bytes object; the decoders
+    # and the hash read straight from the page cache
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as audio_map:
+        key = await cache_key(audio_map)
+        transcription = get_cached_transcription(key)
+        if transcription is None:
+            transcription = await transcribe_with_whisper(audio_map)
+            cache_transcription(key, transcription)
+    
+    return {"original_transcript": transcription}
 
+@app.post("/transcribe/stream/")
+async def transcribe_audio_stream(audio: UploadFile = File(...)):
+    """
+    Stream transcription segments as NDJSON lines while the audio is being decoded.
+    Cached results and clips that fit the batch queue arrive as a single line without timestamps.
+    """
+    log.debug("Received audio file for streaming: %s, content-type: %s", audio.filename, audio.content_type)
+    contents = await audio.read()
+    
+    if len(contents) == 0:
+        raise HTTPException(status_code=400, detail="Empty audio file")
+    
+    key = await cache_key(contents)
+    transcription = get_cached_transcription(key)
+    if transcription is None:
+        samples = await asyncio.to_thread(load_audio, io.BytesIO(contents))
+        # Only recordings longer than one window are worth streaming
+        if len(samples) <= WINDOW_SECONDS * SAMPLE_RATE:
+            transcription = await transcribe_samples(samples)
+            cache_transcription(key, transcription)
+    
+    async def stream_segments():
+        if transcription is not None:
+            if transcription:
+                yield orjson.dumps({"start": None, "end": None, "text": transcription}) + b"\n"
+            return
+        texts = []
+        try:
+            # Hold the inference slot until the stream ends or the client disconnects
+            # aclosing runs stream_transcription's cleanup before the slot is released,
+            # even when Starlette abandons this generator at a yield
+            async with INFER_SEM, contextlib.aclosing(stream_transcription(samples)) as segments:
+                async for start, end, text in segments:
+                    texts.append(text)
+                    yield orjson.dumps({"start": start, "end": end, "text": text}) + b"\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            log_failure("transcribe_audio_stream", e)
+            yield orjson.dumps({"error": f"Transcription failed: {str(e)}"}) + b"\n"
+        else:
+            cache_transcription(key, "".join(texts).strip())
+    
+    return StreamingResponse(stream_segments(), media_type="application/x-ndjson")
 
+@app.post("/enhance/")
+async def enhance_transcription(transcription: str):
+    if not transcription:
+        raise HTTPException(status_code=400, detail="Transcription text is required")
+    
+    enhanced = await enhance_with_ai(transcription)
+    return {"enhanced_transcription": enhanced}
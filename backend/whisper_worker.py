@@ -0,0 +1,178 @@
+"""
+Whisper model and inference functions.
+
+Kept separate from the FastAPI app so ProcessPoolExecutor workers can import it
+without building the app. Without a pool, main.py calls these in threads.
+"""
+import bisect
+import logging
+import os
+import ctranslate2
+import numpy as np
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+
+log = logging.getLogger(__name__)
+
+# Whisper works on 16 kHz audio in 30 second windows
+SAMPLE_RATE = 16000
+WINDOW_SECONDS = 30
+
+# Number of 30 second windows decoded per forward pass
+BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", "8"))
+CLIP_GAP_SECONDS = 1
+
+# Load Whisper model (base model - good balance of speed and accuracy)
+# Model is loaded once per process at startup for better performance
+_whisper_model = None
+_batched_model = None
+_batch_buffer = None
+_device_index = 0
+
+def select_compute_type(device: str) -> str:
+    """
+    Pick the CTranslate2 compute type: int8 weights with float16 activations on GPU,
+    plain float16 on GPUs without int8 kernels, and int8 on CPU.
+    """
+    supported = ctranslate2.get_supported_compute_types(device)
+    preferred = ["int8_float16", "float16"] if device == "cuda" else ["int8"]
+    return next((t for t in preferred if t in supported), "float32")
+
+def get_whisper_model():
+    """Load the Whisper model once; called at startup rather than on import"""
+    global _whisper_model
+    if _whisper_model is None:
+        log.info("Loading Whisper model...")
+        try:
+            device = os.getenv("WHISPER_DEVICE") or (
+                "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+            )
+            compute_type = os.getenv("WHISPER_COMPUTE_TYPE") or select_compute_type(device)
+            _whisper_model = WhisperModel(
+                "base", device=device, device_index=_device_index, compute_type=compute_type
+            )
+            log.info("Whisper model loaded successfully (%s:%d, %s)", device, _device_index, compute_type)
+        except Exception as e:
+            log.error("Error loading Whisper model: %s", e)
+            raise
+    return _whisper_model
+
+def get_batched_model():
+    """Wrap the Whisper model in a pipeline that decodes several windows per forward pass"""
+    global _batched_model
+    if _batched_model is None:
+        _batched_model = BatchedInferencePipeline(get_whisper_model())
+    return _batched_model
+
+def pack_clips(lengths: list) -> list:
+    """
+    Place clips back to back into 30 second windows in arrival order, with a gap of
+    silence between neighbours. Returns a (window, offset in samples) pair per clip.
+    """
+    slot = WINDOW_SECONDS * SAMPLE_RATE
+    gap = CLIP_GAP_SECONDS * SAMPLE_RATE
+    placements = []
+    window, used = 0, 0
+    for length in lengths:
+        offset = used + gap if used else 0
+        if offset + length > slot:
+            window, offset = window + 1, 0
+        placements.append((window, offset))
+        used = offset + length
+    return placements
+
+def transcribe_batch(audios: list) -> list:
+    """
+    Transcribe several short clips (up to 30 seconds each) in one batched forward pass.
+    Clips are packed together into as few 30 second windows as possible, and word
+    timestamps map the text back to the clip it came from.
+    The language is detected per 30 second window, so clips from different requests
+    only share a detected language when they are packed into the same window.
+    Batches must not run concurrently since they share a staging buffer.
+    """
+    global _batch_buffer
+    slot = WINDOW_SECONDS * SAMPLE_RATE
+    gap = CLIP_GAP_SECONDS * SAMPLE_RATE
+    placements = pack_clips([len(audio) for audio in audios])
+    n_windows = placements[-1][0] + 1
+
+    # Reuse one staging buffer across batches; samples past each window's last clip
+    # are never read because the pipeline only slices the given clip_timestamps
+    if _batch_buffer is None or len(_batch_buffer) < n_windows * slot:
+        _batch_buffer = np.empty(max(BATCH_SIZE, n_windows) * slot, dtype=np.float32)
+    combined = _batch_buffer[:n_windows * slot]
+
+    # A word belongs to the clip whose region (split halfway through the gap) contains it
+    boundaries = []
+    window_ends = [0] * n_windows
+    for audio, (window, offset) in zip(audios, placements):
+        start = window * slot + offset
+        if offset:
+            combined[start - gap:start] = 0
+        combined[start:start + len(audio)] = audio
+        boundaries.append((start - (gap / 2 if offset else 0)) / SAMPLE_RATE)
+        window_ends[window] = offset + len(audio)
+    clip_timestamps = [
+        {"start": i * WINDOW_SECONDS, "end": i * WINDOW_SECONDS + end / SAMPLE_RATE}
+        for i, end in enumerate(window_ends)
+    ]
+
+    segments, _ = get_batched_model().transcribe(
+        combined,
+        clip_timestamps=clip_timestamps,
+        batch_size=BATCH_SIZE,
+        beam_size=1,
+        word_timestamps=True,
+        # Detect the language per window from the encoder output already computed,
+        # instead of once for every request in the batch
+        multilingual=True,
+    )
+
+    texts = [[] for _ in audios]
+    for segment in segments:
+        for word in segment.words or []:
+            index = bisect.bisect_right(boundaries, (word.start + word.end) / 2) - 1
+            texts[max(index, 0)].append(word.word)
+    return ["".join(text).strip() for text in texts]
+
+def transcribe_segments(audio: np.ndarray):
+    """
+    Start transcribing a recording of any length; the pipeline splits it into windows
+    and batches them itself. Segments are decoded lazily as the result is iterated.
+    """
+    segments, _ = get_batched_model().transcribe(
+        audio, batch_size=BATCH_SIZE, beam_size=1, vad_filter=True
+    )
+    return segments
+
+def transcribe_long(audio: np.ndarray) -> str:
+    """Transcribe a long recording in one go"""
+    return "".join(segment.text for segment in transcribe_segments(audio)).strip()
+
+def warmup():
+    """Load the model and run one batched pass over a second of silence"""
+    silence = np.zeros(SAMPLE_RATE, dtype=np.float32)
+    transcribe_batch([silence])
+
+def stream_segments(audio: np.ndarray, segment_queue, stop_event):
+    """
+    Transcribe a recording in a pool worker, putting (start, end, text) tuples on
+    segment_queue as they are decoded, followed by None. Stops early once
+    stop_event is set, e.g. when the client has disconnected.
+    """
+    try:
+        for segment in transcribe_segments(audio):
+            if stop_event.is_set():
+                break
+            segment_queue.put((segment.start, segment.end, segment.text))
+    finally:
+        segment_queue.put(None)
+
+def init_worker(worker_counter, n_gpus: int):
+    """Pool initializer: pin this process to a GPU in round-robin order and load the model"""
+    global _device_index
+    with worker_counter.get_lock():
+        worker_id = worker_counter.value
+        worker_counter.value += 1
+    if n_gpus:
+        _device_index = worker_id % n_gpus
+    get_batched_model()